@@ -1,9 +1,9 @@
 import socket
-import threading
 import logging
 import time
 from logging.handlers import RotatingFileHandler
 from modbus_protocol import *
+import modbus_exception as Exceptions
 
 class ModbusClient(object):
     
@@ -18,7 +18,6 @@ class ModbusClient(object):
         self.__logging_level = logging.INFO
 
         if (len(params) == 2) & isinstance(params[0], str) & isinstance(params[1], int):
-            self.__tcpClientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.__ipAddress = params[0]
             self.__port = params[1]
         else:
@@ -29,37 +28,28 @@ class ModbusClient(object):
 
     def connect(self):
         if self.__tcpClientSocket is not None:
-            self.__tcpClientSocket.settimeout(5)
-            self.__tcpClientSocket.connect((self.__ipAddress, self.__port))
-            self.__connected = True
-            self.__thread = threading.Thread(target=self.__listen, args=())
-            self.__thread.start()
-            print(f"Modbus client connected to TCP network, IP Address: {self.__ipAddress}, Port: {self.__port}.")
-            logging.info(f"Modbus client connected to TCP network, IP Address: {self.__ipAddress}, Port: {self.__port}.")
-
-    def __listen(self):
-        self.__stoplistening = False
-        self.__receivedata = bytearray()
-        try:
-            while not self.__stoplistening:
-                if len(self.__receivedata) == 0:
-                    self.__receivedata = bytearray()
-                    if self.__tcpClientSocket is not None:
-                        self.__receivedata = self.__tcpClientSocket.recv(256)
-        except socket.timeout:
-            self.__receivedata = None
+            self.__tcpClientSocket.close()
+        self.__connected = False
+        self.__tcpClientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__tcpClientSocket.settimeout(self.__timeout)
+        self.__tcpClientSocket.connect((self.__ipAddress, self.__port))
+        self.__connected = True
+        print(f"Modbus client connected to TCP network, IP Address: {self.__ipAddress}, Port: {self.__port}.")
+        logging.info(f"Modbus client connected to TCP network, IP Address: {self.__ipAddress}, Port: {self.__port}.")
 
     def close(self):
         if self.__tcpClientSocket is not None:
-            self.__stoplistening = True
-            self.__tcpClientSocket.shutdown(socket.SHUT_RDWR)
+            try:
+                self.__tcpClientSocket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self.__tcpClientSocket.close()
         self.__connected = False
         print("Modbus client connection closed.")
         logging.info("Modbus client connection closed.")
 
     def execute_command(self, starting_address, quantity=0, function_code=FunctionCode.READ_HOLDING_REGISTERS, values=None):
-        self.__adu.mbap_header.transaction_identifier += 1
+        self.__adu.mbap_header.transaction_identifier = (self.__adu.mbap_header.transaction_identifier + 1) & 0xFFFF
         
         if ((starting_address > 65535) | (quantity > 125)) & (function_code == FunctionCode.READ_HOLDING_REGISTERS):
             raise ValueError("Starting address must be 0 - 65535; quantity must be 0 - 125")
@@ -98,14 +88,7 @@ class ModbusClient(object):
                 self.__adu.pdu.data.append(value_to_write[i] & 0xFF)
 
         if self.__tcpClientSocket is not None:
-            self.__tcpClientSocket.send(self.__adu.build_modbus_tcp_frame())
-            self.__receivedata = bytearray()
-            try:
-                while len(self.__receivedata) == 0:
-                    time.sleep(0.001)
-            except Exception:
-                raise Exception('Read Timeout')
-            self.__adu.decode(bytearray(self.__receivedata))
+            self.__send_and_receive()
         
         if function_code == FunctionCode.READ_HOLDING_REGISTERS:
             return_value = list()
@@ -113,6 +96,56 @@ class ModbusClient(object):
                 return_value.append((self.__adu.pdu.data[i * 2 + 1] << 8) + self.__adu.pdu.data[i * 2 + 2])
             return return_value
         
+    def execute_pdu(self, function_code, data, unit_identifier=0xFF):
+        """
+        Sends a raw request PDU and returns the function code and data of the response PDU
+        """
+        if self.__tcpClientSocket is None:
+            raise Exceptions.ConnectionException("Modbus client is not connected")
+
+        self.__adu.mbap_header.transaction_identifier = (self.__adu.mbap_header.transaction_identifier + 1) & 0xFFFF
+        self.__adu.mbap_header.length = len(data) + 2
+        self.__adu.mbap_header.unit_identifier = unit_identifier
+        self.__adu.pdu.function_code = function_code
+        self.__adu.pdu.data = bytearray(data)
+
+        self.__send_and_receive()
+        return self.__adu.pdu.function_code, bytes(self.__adu.pdu.data)
+
+    def __send_and_receive(self):
+        transaction_identifier = self.__adu.mbap_header.transaction_identifier
+        deadline = time.monotonic() + self.__timeout
+        self.__tcpClientSocket.sendall(self.__adu.build_modbus_tcp_frame())
+        try:
+            while True:
+                header_frame = self.__receive(7, deadline)
+                mbap_header = MBAPHeader()
+                mbap_header.decode(header_frame)
+                if mbap_header.protocol_identifier != 0 or mbap_header.length < 2:
+                    self.__connected = False
+                    raise Exceptions.ConnectionException("Invalid MBAP header received")
+                self.__receivedata = header_frame + self.__receive(mbap_header.length - 1, deadline)
+                if mbap_header.transaction_identifier == transaction_identifier:
+                    break
+                logging.info(f"Dropped stale response frame, transaction identifier: {mbap_header.transaction_identifier}")
+        except socket.timeout:
+            raise Exceptions.TimeoutError('Read Timeout')
+        self.__adu.decode(self.__receivedata)
+
+    def __receive(self, length, deadline):
+        data = bytearray()
+        while len(data) < length:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exceptions.TimeoutError('Read Timeout')
+            self.__tcpClientSocket.settimeout(remaining)
+            chunk = self.__tcpClientSocket.recv(length - len(data))
+            if not chunk:
+                self.__connected = False
+                raise Exceptions.ConnectionException("Connection closed by Modbus server")
+            data.extend(chunk)
+        return data
+
     def read_holding_registers(self, starting_address, quantity):
         starting_address = f"0x{starting_address:04X}"
         print(f"Request to Read Holding Registers (FC03), starting address: {starting_address}, quantity: {quantity}")
@@ -9,6 +9,7 @@ class ExceptionCodes(IntEnum):
     ACKNOWLEDGE = 5
     SLAVE_DEVICE_BUSY = 6
     GATEWAY_PATH_UNAVAILABLE = 10
+    GATEWAY_TARGET_DEVICE_FAILED_TO_RESPOND = 11
 
 class ModbusException(Exception):
     
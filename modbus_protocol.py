@@ -4,9 +4,16 @@ import modbus_exception as Exceptions
 import logging
 
 class FunctionCode(IntEnum):
+    READ_COILS = 1
+    READ_DISCRETE_INPUTS = 2
     READ_HOLDING_REGISTERS = 3
+    READ_INPUT_REGISTERS = 4
+    WRITE_SINGLE_COIL = 5
     WRITE_SINGLE_REGISTER = 6
+    WRITE_MULTIPLE_COILS = 15
     WRITE_MULTIPLE_REGISTERS = 16
+    MASK_WRITE_REGISTER = 22
+    READ_WRITE_MULTIPLE_REGISTERS = 23
 
 class MBAPHeader:
     transaction_identifier: int = 0
@@ -28,7 +35,7 @@ class MBAPHeader:
     def decode(self, data: bytearray):
         self.transaction_identifier = data[1] | (data[0] << 8)
         self.protocol_identifier = data[3] | (data[2] << 8)
-        self.transaction_identifier = data[5] | (data[4] << 8)
+        self.length = data[5] | (data[4] << 8)
         self.unit_identifier = data[6]
         
 class PDU:
@@ -59,8 +66,12 @@ class PDU:
         self.data = data[1:len(data)]
 
 class ADU:
-    mbap_header: MBAPHeader = MBAPHeader()
-    pdu: PDU = PDU()
+    mbap_header: MBAPHeader
+    pdu: PDU
+
+    def __init__(self):
+        self.mbap_header = MBAPHeader()
+        self.pdu = PDU()
 
     def build_modbus_tcp_frame(self):
         return_value = bytearray()
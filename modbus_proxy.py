@@ -0,0 +1,284 @@
+import socket
+import threading
+import logging
+import time
+from modbus_protocol import *
+import modbus_exception as Exceptions
+
+READ_FUNCTION_CODES = (FunctionCode.READ_COILS, FunctionCode.READ_DISCRETE_INPUTS,
+                       FunctionCode.READ_HOLDING_REGISTERS, FunctionCode.READ_INPUT_REGISTERS)
+WRITE_FUNCTION_CODES = (FunctionCode.WRITE_SINGLE_COIL, FunctionCode.WRITE_SINGLE_REGISTER,
+                        FunctionCode.WRITE_MULTIPLE_COILS, FunctionCode.WRITE_MULTIPLE_REGISTERS,
+                        FunctionCode.MASK_WRITE_REGISTER, FunctionCode.READ_WRITE_MULTIPLE_REGISTERS)
+
+# MBAP length covers the unit identifier and a PDU of at most 253 bytes
+MAX_MBAP_LENGTH = 254
+
+class ModbusProxy(object):
+    """
+    Modbus-TCP proxy server. Accepts many upstream client connections and forwards their
+    requests, one at a time, over a single downstream ModbusClient connection.
+    The downstream connection is opened on demand and reopened after a failure.
+    Identical concurrent reads are served by one downstream request, and read responses
+    are cached for cache_time seconds. Writes invalidate the cache.
+    """
+
+    def __init__(self, modbus_client, ip_address='0.0.0.0', port=502):
+        self.__modbus_client = modbus_client
+        self.__ipAddress = ip_address
+        self.__port = port
+        self.__cache_time = 0.1
+        self.__idle_timeout = 60
+        self.__max_clients = 32
+        self.__serverSocket = None
+        self.__running = False
+        self.__downstream_lock = threading.Lock()
+        self.__state_lock = threading.Lock()
+        self.__in_flight = dict()
+        self.__cache = dict()
+        self.__generation = 0
+        self.__connections = set()
+
+        print("ModbusTCP proxy class initialized")
+        logging.debug("ModbusTCP proxy class initialized")
+
+    def start(self):
+        self.__serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__serverSocket.bind((self.__ipAddress, self.__port))
+        self.__serverSocket.listen()
+        self.__port = self.__serverSocket.getsockname()[1]
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__accept, args=(), daemon=True)
+        self.__thread.start()
+        print(f"Modbus proxy listening on IP Address: {self.__ipAddress}, Port: {self.__port}.")
+        logging.info(f"Modbus proxy listening on IP Address: {self.__ipAddress}, Port: {self.__port}.")
+
+    def stop(self):
+        self.__running = False
+        if self.__serverSocket is not None:
+            self.__serverSocket.close()
+            self.__serverSocket = None
+        with self.__state_lock:
+            connections = list(self.__connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        print("Modbus proxy stopped.")
+        logging.info("Modbus proxy stopped.")
+
+    def __accept(self):
+        while self.__running:
+            try:
+                connection, address = self.__serverSocket.accept()
+            except OSError:
+                break
+            with self.__state_lock:
+                if not self.__running:
+                    connection.close()
+                    break
+                if len(self.__connections) >= self.__max_clients:
+                    connection.close()
+                    logging.info(f"Modbus proxy rejected upstream client {address[0]}:{address[1]}, {self.__max_clients} clients connected.")
+                    continue
+                self.__connections.add(connection)
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            connection.settimeout(self.__idle_timeout)
+            print(f"Modbus proxy accepted upstream client {address[0]}:{address[1]}.")
+            logging.info(f"Modbus proxy accepted upstream client {address[0]}:{address[1]}.")
+            threading.Thread(target=self.__serve_client, args=(connection, address), daemon=True).start()
+
+    def __serve_client(self, connection, address):
+        try:
+            while self.__running:
+                header_frame = self.__receive(connection, 7)
+                if header_frame is None:
+                    break
+                mbap_header = MBAPHeader()
+                mbap_header.decode(header_frame)
+                if mbap_header.protocol_identifier != 0 or not 2 <= mbap_header.length <= MAX_MBAP_LENGTH:
+                    break
+                pdu_frame = self.__receive(connection, mbap_header.length - 1)
+                if pdu_frame is None:
+                    break
+
+                function_code, data = self.__process_request(mbap_header.unit_identifier, pdu_frame[0], bytes(pdu_frame[1:]))
+                if not self.__running:
+                    break
+
+                # The upstream transaction identifier is restored on the response
+                response = PDU()
+                response.function_code = function_code
+                response.data = bytearray(data)
+                mbap_header.length = len(data) + 2
+                connection.sendall(mbap_header.build_frame() + response.build_frame())
+        except socket.timeout:
+            logging.info(f"Modbus proxy upstream client {address[0]}:{address[1]} idle for {self.__idle_timeout} s.")
+        except OSError as e:
+            logging.info(f"Modbus proxy upstream client {address[0]}:{address[1]} error: {e}")
+        finally:
+            with self.__state_lock:
+                self.__connections.discard(connection)
+            connection.close()
+            print(f"Modbus proxy closed upstream client {address[0]}:{address[1]}.")
+            logging.info(f"Modbus proxy closed upstream client {address[0]}:{address[1]}.")
+
+    def __receive(self, connection, length):
+        data = bytearray()
+        while len(data) < length:
+            chunk = connection.recv(length - len(data))
+            if not chunk:
+                return None
+            data.extend(chunk)
+        return data
+
+    def __process_request(self, unit_identifier, function_code, data):
+        if function_code in WRITE_FUNCTION_CODES:
+            response = self.__forward(unit_identifier, function_code, data)
+            # Reads fetched before the write completed must not be cached or shared
+            with self.__state_lock:
+                self.__generation += 1
+                self.__cache.clear()
+            return response
+        if function_code not in READ_FUNCTION_CODES:
+            return self.__forward(unit_identifier, function_code, data)
+
+        with self.__state_lock:
+            generation = self.__generation
+            key = (unit_identifier, function_code, data)
+            cached = self.__cache.get(key)
+            if cached is not None:
+                if time.monotonic() - cached[0] < self.__cache_time:
+                    return cached[1]
+                del self.__cache[key]
+            pending = self.__in_flight.get((generation, key))
+            owner = pending is None
+            if owner:
+                pending = [threading.Event(), None]
+                self.__in_flight[(generation, key)] = pending
+
+        if not owner:
+            pending[0].wait()
+            return pending[1]
+
+        response = self.__forward(unit_identifier, function_code, data)
+        with self.__state_lock:
+            del self.__in_flight[(generation, key)]
+            if response[0] == function_code and generation == self.__generation and self.__cache_time > 0:
+                now = time.monotonic()
+                for expired in [k for k, v in self.__cache.items() if now - v[0] >= self.__cache_time]:
+                    del self.__cache[expired]
+                self.__cache[key] = (now, response)
+        pending[1] = response
+        pending[0].set()
+        return response
+
+    def __forward(self, unit_identifier, function_code, data):
+        with self.__downstream_lock:
+            try:
+                if not self.__modbus_client.is_connected():
+                    self.__modbus_client.connect()
+            except OSError as e:
+                logging.info(f"Modbus proxy downstream connect failed: {e}")
+                self.__modbus_client.close()
+                return function_code | 0x80, bytes([Exceptions.ExceptionCodes.GATEWAY_PATH_UNAVAILABLE])
+            try:
+                return self.__modbus_client.execute_pdu(function_code, data, unit_identifier)
+            except Exception as e:
+                # Reconnect on the next request so a late or partial reply cannot desync the stream
+                logging.info(f"Modbus proxy downstream request failed: {e}")
+                self.__modbus_client.close()
+                return function_code | 0x80, bytes([Exceptions.ExceptionCodes.GATEWAY_TARGET_DEVICE_FAILED_TO_RESPOND])
+
+    @property
+    def port(self):
+        """
+        Gets the Port were the proxy accepts upstream clients (0 selects a free port on start)
+        """
+        return self.__port
+
+    @property
+    def ipaddress(self):
+        """
+        Gets the IP-Address the proxy is bound to
+        """
+        return self.__ipAddress
+
+    @property
+    def cache_time(self):
+        """
+        Gets the time in seconds a read response is served from the cache
+        """
+        return self.__cache_time
+
+    @cache_time.setter
+    def cache_time(self, cache_time):
+        """
+        Sets the time in seconds a read response is served from the cache (0 disables the cache)
+        """
+        self.__cache_time = cache_time
+
+    @property
+    def idle_timeout(self):
+        """
+        Gets the time in seconds after which an idle upstream client is disconnected
+        """
+        return self.__idle_timeout
+
+    @idle_timeout.setter
+    def idle_timeout(self, idle_timeout):
+        """
+        Sets the time in seconds after which an idle upstream client is disconnected (None waits forever)
+        """
+        self.__idle_timeout = idle_timeout
+
+    @property
+    def max_clients(self):
+        """
+        Gets the maximum number of concurrent upstream clients
+        """
+        return self.__max_clients
+
+    @max_clients.setter
+    def max_clients(self, max_clients):
+        """
+        Sets the maximum number of concurrent upstream clients
+        """
+        self.__max_clients = max_clients
+
+    def is_running(self):
+        """
+        Returns true if the proxy accepts upstream clients
+        """
+        return self.__running
+
+if __name__ == "__main__":
+    import argparse
+    from modbus_client import ModbusClient
+
+    parser = argparse.ArgumentParser(description="ModbusTCP proxy sharing one device connection between many clients")
+    parser.add_argument("device_host", help="IP-Address of the Modbus-TCP device")
+    parser.add_argument("--device-port", type=int, default=502, help="Port of the Modbus-TCP device (default 502)")
+    parser.add_argument("--host", default="0.0.0.0", help="IP-Address the proxy listens on (default 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=502, help="Port the proxy listens on (default 502)")
+    parser.add_argument("--cache-time", type=float, default=0.1, help="Seconds a read response is cached, 0 disables (default 0.1)")
+    parser.add_argument("--idle-timeout", type=float, default=60, help="Seconds before an idle upstream client is disconnected (default 60)")
+    parser.add_argument("--max-clients", type=int, default=32, help="Maximum number of upstream clients (default 32)")
+    args = parser.parse_args()
+
+    modbus_client = ModbusClient(args.device_host, args.device_port)
+    modbus_proxy = ModbusProxy(modbus_client, args.host, args.port)
+    modbus_proxy.cache_time = args.cache_time
+    modbus_proxy.idle_timeout = args.idle_timeout
+    modbus_proxy.max_clients = args.max_clients
+    modbus_proxy.start()
+    try:
+        while modbus_proxy.is_running():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        modbus_proxy.stop()
+        modbus_client.close()
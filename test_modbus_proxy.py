@@ -0,0 +1,221 @@
+import socket
+import threading
+import time
+import unittest
+from modbus_client import ModbusClient
+from modbus_protocol import ADU
+from modbus_proxy import ModbusProxy
+
+class FakeDevice(object):
+    """
+    Minimal Modbus-TCP server holding 256 registers (FC03, FC04, FC06); input registers read inverted
+    """
+
+    def __init__(self):
+        self.registers = list(range(256))
+        self.requests = 0
+        self.delay = 0
+        self.silent = False
+        self.stale_reply = False
+        self.__serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__serverSocket.bind(('127.0.0.1', 0))
+        self.__serverSocket.listen()
+        self.port = self.__serverSocket.getsockname()[1]
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def close(self):
+        self.__serverSocket.close()
+
+    def __accept(self):
+        while True:
+            try:
+                connection, _ = self.__serverSocket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.__serve, args=(connection,), daemon=True).start()
+
+    def __serve(self, connection):
+        with connection:
+            while True:
+                header = self.__receive(connection, 7)
+                if header is None:
+                    return
+                pdu = self.__receive(connection, ((header[4] << 8) | header[5]) - 1)
+                self.requests += 1
+                time.sleep(self.delay)
+                if self.silent:
+                    continue
+                address = (pdu[1] << 8) | pdu[2]
+                if pdu[0] in (3, 4):
+                    quantity = (pdu[3] << 8) | pdu[4]
+                    response = bytearray([pdu[0], quantity * 2])
+                    for value in self.registers[address:address + quantity]:
+                        if pdu[0] == 4:
+                            value ^= 0xFFFF
+                        response.extend([value >> 8, value & 0xFF])
+                elif pdu[0] == 6:
+                    self.registers[address] = (pdu[3] << 8) | pdu[4]
+                    response = bytearray(pdu)
+                else:
+                    response = bytearray([pdu[0] | 0x80, 1])
+                mbap = bytearray([header[0], header[1], 0, 0, 0, len(response) + 1, header[6]])
+                if self.stale_reply:
+                    self.stale_reply = False
+                    connection.sendall(bytes([header[0] ^ 0xFF, header[1], 0, 0, 0, 5, header[6], 3, 2, 0xDE, 0xAD]))
+                connection.sendall(mbap + response)
+
+    def __receive(self, connection, length):
+        data = bytearray()
+        while len(data) < length:
+            try:
+                chunk = connection.recv(length - len(data))
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            data.extend(chunk)
+        return data
+
+class ModbusProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = FakeDevice()
+        self.client = ModbusClient('127.0.0.1', self.device.port)
+        self.client.timeout = 0.5
+        self.proxy = ModbusProxy(self.client, '127.0.0.1', 0)
+        self.proxy.start()
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.client.close()
+        self.device.close()
+
+    def request(self, transaction_identifier, pdu, connection=None):
+        upstream = connection or socket.create_connection(('127.0.0.1', self.proxy.port), timeout=5)
+        try:
+            upstream.sendall(bytes([transaction_identifier >> 8, transaction_identifier & 0xFF, 0, 0, 0, len(pdu) + 1, 1]) + bytes(pdu))
+            header = self.receive(upstream, 7)
+            return header, self.receive(upstream, ((header[4] << 8) | header[5]) - 1)
+        finally:
+            if connection is None:
+                upstream.close()
+
+    def receive(self, connection, length):
+        data = bytearray()
+        while len(data) < length:
+            chunk = connection.recv(length - len(data))
+            self.assertTrue(chunk)
+            data.extend(chunk)
+        return bytes(data)
+
+    def read(self, address, quantity, transaction_identifier=1):
+        return self.request(transaction_identifier, [3, address >> 8, address & 0xFF, quantity >> 8, quantity & 0xFF])[1]
+
+    def test_transaction_identifier_restored(self):
+        header, pdu = self.request(0xBEEF, [3, 0, 4, 0, 1])
+        self.assertEqual(header[:2], bytes([0xBE, 0xEF]))
+        self.assertEqual(pdu, bytes([3, 2, 0, 4]))
+
+    def test_concurrent_reads_share_one_request(self):
+        self.device.delay = 0.2
+        results = list()
+        threads = [threading.Thread(target=lambda i=i: results.append(self.read(0, 2, i))) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [bytes([3, 4, 0, 0, 0, 1])] * 10)
+        self.assertEqual(self.device.requests, 1)
+
+    def test_cache_expires(self):
+        self.proxy.cache_time = 0.2
+        self.read(0, 1)
+        self.read(0, 1)
+        self.assertEqual(self.device.requests, 1)
+        time.sleep(0.3)
+        self.read(0, 1)
+        self.assertEqual(self.device.requests, 2)
+
+    def test_write_invalidates_cache(self):
+        self.proxy.cache_time = 10
+        self.assertEqual(self.read(5, 1), bytes([3, 2, 0, 5]))
+        self.request(2, [6, 0, 5, 0x12, 0x34])
+        self.assertEqual(self.read(5, 1), bytes([3, 2, 0x12, 0x34]))
+
+    def test_write_during_read_is_not_cached_stale(self):
+        self.proxy.cache_time = 10
+        self.device.delay = 0.2
+        reader = threading.Thread(target=self.read, args=(5, 1))
+        reader.start()
+        time.sleep(0.05)
+        self.request(2, [6, 0, 5, 0x12, 0x34])
+        reader.join()
+        self.assertEqual(self.read(5, 1), bytes([3, 2, 0x12, 0x34]))
+
+    def test_input_register_read_keeps_holding_register_cache(self):
+        self.proxy.cache_time = 10
+        self.assertEqual(self.read(0, 1), bytes([3, 2, 0, 0]))
+        self.assertEqual(self.request(2, [4, 0, 0, 0, 1])[1], bytes([4, 2, 0xFF, 0xFF]))
+        self.assertEqual(self.request(3, [4, 0, 0, 0, 1])[1], bytes([4, 2, 0xFF, 0xFF]))
+        self.assertEqual(self.read(0, 1), bytes([3, 2, 0, 0]))
+        self.assertEqual(self.device.requests, 2)
+
+    def test_max_size_read(self):
+        expected = bytearray([3, 250])
+        for value in range(125):
+            expected.extend([value >> 8, value & 0xFF])
+        self.assertEqual(self.read(0, 125), bytes(expected))
+        self.assertEqual(self.read(200, 1), bytes([3, 2, 0, 200]))
+
+    def test_stale_response_dropped(self):
+        self.device.stale_reply = True
+        self.assertEqual(self.read(7, 1), bytes([3, 2, 0, 7]))
+
+    def test_downstream_timeout_then_recover(self):
+        self.device.silent = True
+        self.assertEqual(self.read(0, 1), bytes([0x83, 0x0B]))
+        self.device.silent = False
+        self.assertEqual(self.read(1, 1), bytes([3, 2, 0, 1]))
+
+    def test_survives_idle_downstream(self):
+        self.assertEqual(self.read(0, 1), bytes([3, 2, 0, 0]))
+        time.sleep(self.client.timeout + 0.3)
+        self.assertEqual(self.read(1, 1), bytes([3, 2, 0, 1]))
+        self.assertEqual(self.device.requests, 2)
+
+    def test_oversized_frame_rejected(self):
+        upstream = socket.create_connection(('127.0.0.1', self.proxy.port), timeout=5)
+        upstream.sendall(bytes([0, 1, 0, 0, 0x01, 0x00, 1]))
+        self.assertEqual(upstream.recv(16), b'')
+        upstream.close()
+        self.assertEqual(self.device.requests, 0)
+
+    def test_idle_upstream_client_disconnected(self):
+        self.proxy.idle_timeout = 0.2
+        upstream = socket.create_connection(('127.0.0.1', self.proxy.port), timeout=5)
+        self.assertEqual(upstream.recv(16), b'')
+        upstream.close()
+
+    def test_max_clients(self):
+        self.proxy.max_clients = 1
+        first = socket.create_connection(('127.0.0.1', self.proxy.port), timeout=5)
+        self.request(1, [3, 0, 0, 0, 1], first)
+        second = socket.create_connection(('127.0.0.1', self.proxy.port), timeout=5)
+        self.assertEqual(second.recv(16), b'')
+        second.close()
+        self.request(2, [3, 0, 0, 0, 1], first)
+        first.close()
+
+    def test_adu_state_not_shared(self):
+        self.assertIsNot(ADU().pdu, ADU().pdu)
+        self.assertIsNot(ADU().mbap_header, ADU().mbap_header)
+
+    def test_stop_closes_upstream_connections(self):
+        upstream = socket.create_connection(('127.0.0.1', self.proxy.port), timeout=5)
+        self.request(1, [3, 0, 0, 0, 1], upstream)
+        self.proxy.stop()
+        self.assertEqual(upstream.recv(16), b'')
+        upstream.close()
+
+if __name__ == "__main__":
+    unittest.main()